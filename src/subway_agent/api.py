@@ -1,23 +1,57 @@
 """FastAPI web interface for the subway agent."""
 
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 
-from .agent import chat, clear_history
-from .stations import find_station, STATIONS
+from .agent import ReplaceText, achat, chat_stream, clear_history, get_agent
+from .stations import find_station, LINE_BITS, STATIONS, STATIONS_BY_BOROUGH, STATIONS_BY_LINE
 from .mta_feed import get_arrivals
-from .routing import find_route
+from .routing import find_route, warm_route_cache
 from .database import db
 
 STATIC_DIR = Path(__file__).parent / "static"
 SUBWAY_API_KEY = os.getenv("SUBWAY_API_KEY")
 
+# /arrivals responses are reused for this many seconds per (station, line),
+# so bursts of identical requests share one feed scan
+ARRIVALS_TTL = 15
+_ARRIVALS_CACHE_SIZE = 512
+_arrivals_cache: dict[tuple[str, Optional[str]], tuple[float, dict]] = {}
+_arrivals_lock = threading.Lock()
+
+# Routes for the most requested station pairs are precomputed in the
+# background and refreshed this often (seconds)
+POPULAR_ROUTES = 50
+ROUTE_CACHE_REFRESH = 600
+
+# /stations entries, built once since the station list is static
+_STATION_ENTRIES = {
+    s.id: {"id": s.id, "name": s.name, "lines": s.lines, "borough": s.borough}
+    for s in STATIONS.values()
+}
+
+# Unfiltered /stations body and its validator; clients revalidate with
+# If-None-Match and get a bodiless 304 while the list is unchanged
+_ALL_STATIONS_JSON = json.dumps(
+    {"count": len(_STATION_ENTRIES), "stations": list(_STATION_ENTRIES.values())},
+    separators=(",", ":"),
+).encode()
+_ALL_STATIONS_ETAG = '"%s"' % hashlib.md5(_ALL_STATIONS_JSON, usedforsecurity=False).hexdigest()
+_STATIONS_CACHE_CONTROL = "private, max-age=3600"
+
 
 async def verify_api_key(
     key: Optional[str] = Query(None),
@@ -29,10 +63,45 @@ async def verify_api_key(
         raise HTTPException(status_code=401, detail="Invalid API key")
     return provided_key
 
+def _warm_agent():
+    """Build the agent so the first chat request doesn't pay for it."""
+    try:
+        get_agent()
+    except Exception as e:
+        print(f"Warning: could not build agent at startup: {e}")
+
+
+def _warm_popular_routes():
+    """Precompute routes for the station pairs users request most."""
+    warm_route_cache(db.get_popular_trips(POPULAR_ROUTES))
+
+
+async def _refresh_popular_routes():
+    """Keep the popular-route cache in step with trip history."""
+    while True:
+        try:
+            await run_in_threadpool(_warm_popular_routes)
+        except Exception as e:
+            print(f"Warning: could not precompute popular routes: {e}")
+        await asyncio.sleep(ROUTE_CACHE_REFRESH)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each worker builds its own agent; the compiled graph can't be pickled
+    # and shared, so start building it as soon as the worker is up
+    threading.Thread(target=_warm_agent, daemon=True).start()
+    route_task = asyncio.create_task(_refresh_popular_routes())
+    yield
+    route_task.cancel()
+    db.close()
+
+
 app = FastAPI(
     title="NYC Subway Agent",
     description="AI-powered NYC subway routing assistant",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware
@@ -81,16 +150,46 @@ async def root(_: str = Depends(verify_api_key)):
 async def chat_endpoint(request: ChatRequest, _: str = Depends(verify_api_key)):
     """Chat with the subway agent."""
     try:
-        response = chat(request.message, request.user_id)
+        response = await achat(request.message, request.user_id)
         return ChatResponse(response=response, user_id=request.user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _sse_events(message: str, user_id: str):
+    """Format chat_stream output as server-sent events.
+
+    Each text chunk is a JSON-encoded string in a "data" line; a "replace"
+    event carries the full reply when it supersedes the text sent so far.
+    The stream ends with a "done" event, or an "error" event if the turn
+    fails.
+    """
+    try:
+        async for text in chat_stream(message, user_id):
+            if isinstance(text, ReplaceText):
+                yield f"event: replace\ndata: {json.dumps(str(text))}\n\n"
+            else:
+                yield f"data: {json.dumps(text)}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, _: str = Depends(verify_api_key)):
+    """Chat with the subway agent, streaming the reply as server-sent events."""
+    return StreamingResponse(
+        _sse_events(request.message, request.user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @app.post("/clear")
 async def clear_chat(user_id: str = "default", _: str = Depends(verify_api_key)):
     """Clear conversation history."""
-    clear_history(user_id)
+    await run_in_threadpool(clear_history, user_id)
     return {"status": "cleared", "user_id": user_id}
 
 
@@ -105,7 +204,7 @@ async def get_route_endpoint(request: RouteRequest, _: str = Depends(verify_api_
     if not to_st:
         raise HTTPException(status_code=404, detail=f"Station not found: {request.to_station}")
 
-    route = find_route(request.from_station, request.to_station)
+    route = await run_in_threadpool(find_route, request.from_station, request.to_station)
     if not route:
         raise HTTPException(status_code=404, detail="No route found")
 
@@ -134,10 +233,17 @@ async def get_arrivals_endpoint(request: ArrivalsRequest, _: str = Depends(verif
     if not station:
         raise HTTPException(status_code=404, detail=f"Station not found: {request.station}")
 
-    lines = [request.line] if request.line else None
-    arrivals = get_arrivals(station.id, lines)
+    line = request.line.upper() if request.line else None
+    key = (station.id, line)
+    with _arrivals_lock:
+        cached = _arrivals_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
 
-    return {
+    lines = [line] if line else None
+    arrivals = await run_in_threadpool(get_arrivals, station.id, lines)
+
+    result = {
         "station": station.name,
         "arrivals": [
             {
@@ -149,37 +255,61 @@ async def get_arrivals_endpoint(request: ArrivalsRequest, _: str = Depends(verif
             for arr in arrivals[:10]
         ]
     }
+    with _arrivals_lock:
+        if len(_arrivals_cache) >= _ARRIVALS_CACHE_SIZE:
+            now = time.monotonic()
+            for k in [k for k, (expires_at, _) in _arrivals_cache.items() if expires_at <= now]:
+                del _arrivals_cache[k]
+            if len(_arrivals_cache) >= _ARRIVALS_CACHE_SIZE:
+                _arrivals_cache.clear()
+        _arrivals_cache[key] = (time.monotonic() + ARRIVALS_TTL, result)
+    return result
 
 
-@app.get("/stations")
-async def list_stations(borough: Optional[str] = None, line: Optional[str] = None, _: str = Depends(verify_api_key)):
-    """List all stations, optionally filtered."""
-    stations = list(STATIONS.values())
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
-    if borough:
-        stations = [s for s in stations if s.borough.lower() == borough.lower()]
 
-    if line:
-        stations = [s for s in stations if line.upper() in s.lines]
-
-    return {
-        "count": len(stations),
-        "stations": [
-            {
-                "id": s.id,
-                "name": s.name,
-                "lines": s.lines,
-                "borough": s.borough
-            }
-            for s in stations
-        ]
-    }
+@app.get("/stations")
+async def list_stations(
+    borough: Optional[str] = None,
+    line: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    _: str = Depends(verify_api_key),
+):
+    """List all stations, optionally filtered."""
+    if not borough and not line:
+        headers = {"ETag": _ALL_STATIONS_ETAG, "Cache-Control": _STATIONS_CACHE_CONTROL}
+        if if_none_match and _etag_matches(if_none_match, _ALL_STATIONS_ETAG):
+            return Response(status_code=304, headers=headers)
+        return Response(content=_ALL_STATIONS_JSON, media_type="application/json", headers=headers)
+
+    if borough and line:
+        by_borough = STATIONS_BY_BOROUGH.get(borough.lower(), [])
+        by_line = STATIONS_BY_LINE.get(line.upper(), [])
+        # Scan the smaller list, checking membership in the other
+        if len(by_borough) <= len(by_line):
+            line_bit = LINE_BITS.get(line.upper(), 0)
+            stations = [s for s in by_borough if s.lines_mask & line_bit]
+        else:
+            borough = borough.lower()
+            stations = [s for s in by_line if s.borough.lower() == borough]
+    elif borough:
+        stations = STATIONS_BY_BOROUGH.get(borough.lower(), [])
+    else:
+        stations = STATIONS_BY_LINE.get(line.upper(), [])
+
+    entries = [_STATION_ENTRIES[s.id] for s in stations]
+    return {"count": len(entries), "stations": entries}
 
 
 @app.get("/preferences/{user_id}")
 async def get_preferences(user_id: str, _: str = Depends(verify_api_key)):
     """Get all preferences for a user."""
-    prefs = db.get_all_preferences(user_id)
+    prefs = await run_in_threadpool(db.get_all_preferences, user_id)
     return {"user_id": user_id, "preferences": prefs}
 
 
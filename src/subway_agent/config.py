@@ -1,7 +1,9 @@
 """Configuration settings for the subway agent."""
 
 import os
+import threading
 from pathlib import Path
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,8 +32,35 @@ MTA_FEEDS = {
     "L": "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l",
 }
 
-# Map individual lines to their feed
-LINE_TO_FEED = {}
-for feed_name, url in MTA_FEEDS.items():
-    for line in feed_name:
-        LINE_TO_FEED[line] = url
+# Map individual lines to their feed (read-only)
+LINE_TO_FEED = MappingProxyType({
+    line: url for feed_name, url in MTA_FEEDS.items() for line in feed_name
+})
+
+
+# Shared keep-alive HTTP client (Groq, MTA feeds, GTFS download), built on
+# first use; pass a per-request timeout for calls that need a different one
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Get the shared HTTP client, using HTTP/2 when h2 is installed."""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                import httpx
+
+                try:
+                    import h2  # noqa: F401
+                    http2 = True
+                except ImportError:
+                    http2 = False
+                _http_client = httpx.Client(
+                    http2=http2,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+                    timeout=httpx.Timeout(30.0, connect=3.0),
+                )
+    return _http_client
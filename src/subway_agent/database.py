@@ -2,16 +2,23 @@
 
 from __future__ import annotations
 
+import atexit
 import json
-from datetime import datetime
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, event, func, Column, Index, Integer, String, DateTime, Text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 from .config import DB_PATH
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
 
@@ -23,18 +30,20 @@ class UserPreference(Base):
     user_id = Column(String(100), default="default")
     key = Column(String(100), nullable=False)
     value = Column(Text, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, server_default=func.now())
 
 
 class TripHistory(Base):
     """Trip history for learning common routes."""
     __tablename__ = "trip_history"
+    # Covers get_common_trips' filter and GROUP BY
+    __table_args__ = (Index("ix_trip_user_pair", "user_id", "from_station", "to_station"),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(String(100), default="default")
     from_station = Column(String(100), nullable=False)
     to_station = Column(String(100), nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, server_default=func.now())
 
 
 class ConversationMemory(Base):
@@ -45,7 +54,29 @@ class ConversationMemory(Base):
     user_id = Column(String(100), default="default")
     role = Column(String(20), nullable=False)  # "user" or "assistant"
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, server_default=func.now())
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling so writes don't fsync the whole database each commit."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+# Conversation write batching: max seconds a queued message waits, and the
+# batch size that triggers an immediate write
+FLUSH_INTERVAL = 0.03
+FLUSH_BATCH = 128
+
+# Seconds a user's preference dict is served from memory. Writes through
+# set_preference invalidate it immediately; this only bounds staleness
+# from writes made by other processes.
+PREFERENCES_TTL = 60
+# Users whose preferences are held in memory; least recently read go first.
+PREFERENCES_CACHE_SIZE = 1024
 
 
 class Database:
@@ -56,61 +87,110 @@ class Database:
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
         self.engine = create_engine(f"sqlite:///{self.db_path}")
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
         Base.metadata.create_all(self.engine)
+        # create_all skips tables that already exist, indexes included, so
+        # add any indexes introduced after an existing database was created
+        for index in TripHistory.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
         self.Session = sessionmaker(bind=self.engine)
 
-    def set_preference(self, key: str, value: str, user_id: str = "default"):
-        """Set a user preference."""
-        session = self.Session()
+        # Chat history and preferences are read/written on every turn; these
+        # go straight through one sqlite3 connection instead of ORM sessions
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        _set_sqlite_pragmas(self.conn, None)
+        self._lock = threading.Lock()
+
+        # user_id -> (expires_at, preferences), in LRU order
+        self._prefs_cache: OrderedDict[str, tuple[float, dict[str, str]]] = OrderedDict()
+
+        # New conversation rows are queued and written by a background
+        # flusher, so messages arriving close together share one transaction
+        self._pending: list[tuple[str, str, str]] = []
+        self._pending_cond = threading.Condition()
+        self._closing = False  # set under _pending_cond by close()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="subway-db-flush", daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Stop the background flusher, write queued messages and close the connection.
+
+        Safe to call more than once; the instance can't be used afterwards.
+        """
+        with self._pending_cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._pending_cond.notify()
+        atexit.unregister(self.close)
+        self._flush_thread.join()
         try:
-            pref = session.query(UserPreference).filter_by(
-                user_id=user_id, key=key
-            ).first()
-
-            if pref:
-                pref.value = value
-                pref.updated_at = datetime.utcnow()
-            else:
-                pref = UserPreference(user_id=user_id, key=key, value=value)
-                session.add(pref)
+            self.flush()
+        except Exception as e:
+            logger.warning("Could not save %d conversation messages on close: %s", len(self._pending), e)
+        with self._lock:
+            self.conn.close()
+        self.engine.dispose()
 
-            session.commit()
-        finally:
-            session.close()
+    def set_preference(self, key: str, value: str, user_id: str = "default"):
+        """Set a user preference."""
+        # Timestamps are set by SQLite (UTC), in SQL rather than by the column
+        # defaults, since databases created before those defaults lack them
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self.conn.execute(
+                    "UPDATE user_preferences SET value = ?, updated_at = CURRENT_TIMESTAMP "
+                    "WHERE user_id = ? AND key = ?",
+                    (value, user_id, key),
+                )
+                if cur.rowcount == 0:
+                    self.conn.execute(
+                        "INSERT INTO user_preferences (user_id, key, value, updated_at) "
+                        "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                        (user_id, key, value),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._prefs_cache.pop(user_id, None)
 
     def get_preference(self, key: str, user_id: str = "default") -> Optional[str]:
         """Get a user preference."""
-        session = self.Session()
-        try:
-            pref = session.query(UserPreference).filter_by(
-                user_id=user_id, key=key
-            ).first()
-            return pref.value if pref else None
-        finally:
-            session.close()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM user_preferences WHERE user_id = ? AND key = ? LIMIT 1",
+                (user_id, key),
+            ).fetchone()
+        return row[0] if row else None
 
     def get_all_preferences(self, user_id: str = "default") -> dict[str, str]:
         """Get all user preferences."""
-        session = self.Session()
-        try:
-            prefs = session.query(UserPreference).filter_by(user_id=user_id).all()
-            return {p.key: p.value for p in prefs}
-        finally:
-            session.close()
+        with self._lock:
+            cached = self._prefs_cache.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                self._prefs_cache.move_to_end(user_id)
+                return dict(cached[1])
+            prefs = dict(self.conn.execute(
+                "SELECT key, value FROM user_preferences WHERE user_id = ?", (user_id,)
+            ).fetchall())
+            self._prefs_cache[user_id] = (time.monotonic() + PREFERENCES_TTL, prefs)
+            self._prefs_cache.move_to_end(user_id)
+            if len(self._prefs_cache) > PREFERENCES_CACHE_SIZE:
+                self._prefs_cache.popitem(last=False)
+        return dict(prefs)
 
     def add_trip(self, from_station: str, to_station: str, user_id: str = "default"):
         """Record a trip in history."""
-        session = self.Session()
-        try:
-            trip = TripHistory(
-                user_id=user_id,
-                from_station=from_station,
-                to_station=to_station
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO trip_history (user_id, from_station, to_station, timestamp) "
+                "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                (user_id, from_station, to_station),
             )
-            session.add(trip)
-            session.commit()
-        finally:
-            session.close()
 
     def get_common_trips(self, user_id: str = "default", limit: int = 5) -> list[tuple[str, str, int]]:
         """Get most common trips for a user."""
@@ -129,30 +209,93 @@ class Database:
         finally:
             session.close()
 
+    def get_popular_trips(self, limit: int = 50) -> list[tuple[str, str]]:
+        """Get the most recorded (from_station, to_station) pairs across all users."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT from_station, to_station FROM trip_history "
+                "GROUP BY from_station, to_station ORDER BY count(*) DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(from_station, to_station) for from_station, to_station in rows]
+
     def add_message(self, role: str, content: str, user_id: str = "default"):
         """Add a message to conversation history."""
-        session = self.Session()
-        try:
-            msg = ConversationMemory(user_id=user_id, role=role, content=content)
-            session.add(msg)
-            session.commit()
-        finally:
-            session.close()
+        self.add_messages([(role, content)], user_id)
+
+    def add_messages(self, messages: list[tuple[str, str]], user_id: str = "default"):
+        """Queue several (role, content) messages to be saved together.
+
+        Rows are written within FLUSH_INTERVAL seconds; reads through this
+        class flush first, so they always see them.
+        """
+        with self._pending_cond:
+            self._pending.extend((user_id, role, content) for role, content in messages)
+            self._pending_cond.notify()
+
+    def flush(self):
+        """Write any queued conversation messages now.
+
+        If the write fails the rows go back on the queue, ahead of anything
+        queued since, and the error is raised.
+        """
+        with self._lock:
+            with self._pending_cond:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                self.conn.execute("BEGIN")
+                try:
+                    self.conn.executemany(
+                        "INSERT INTO conversation_memory (user_id, role, content, timestamp) "
+                        "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                        rows,
+                    )
+                    self.conn.execute("COMMIT")
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+            except BaseException:
+                with self._pending_cond:
+                    self._pending[:0] = rows
+                raise
+
+    def _flush_loop(self):
+        """Background writer: flush once a batch fills up or FLUSH_INTERVAL passes.
+
+        Exits when close() is called; close() writes whatever is left.
+        """
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait_for(lambda: self._pending or self._closing)
+                self._pending_cond.wait_for(
+                    lambda: len(self._pending) >= FLUSH_BATCH or self._closing, timeout=FLUSH_INTERVAL
+                )
+                if self._closing:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Could not save conversation messages, will retry: %s", e)
+                # Back off before retrying the requeued rows
+                with self._pending_cond:
+                    self._pending_cond.wait_for(lambda: self._closing, timeout=FLUSH_INTERVAL)
 
     def get_recent_messages(self, user_id: str = "default", limit: int = 10) -> list[dict]:
         """Get recent conversation messages."""
-        session = self.Session()
-        try:
-            messages = session.query(ConversationMemory).filter_by(
-                user_id=user_id
-            ).order_by(ConversationMemory.timestamp.desc()).limit(limit).all()
-
-            return [{"role": m.role, "content": m.content} for m in reversed(messages)]
-        finally:
-            session.close()
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, content FROM conversation_memory WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
 
     def clear_conversation(self, user_id: str = "default"):
         """Clear conversation history."""
+        self.flush()
         session = self.Session()
         try:
             session.query(ConversationMemory).filter_by(user_id=user_id).delete()
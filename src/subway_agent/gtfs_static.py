@@ -4,15 +4,45 @@ from __future__ import annotations
 
 import csv
 import io
+import json
+import pickle
+import sys
 import zipfile
-from collections import defaultdict
 from dataclasses import dataclass
+from itertools import pairwise
+from operator import itemgetter
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
-import requests
+import httpx
 
-from .config import DATA_DIR
+from .config import DATA_DIR, get_http_client
+
+
+def _read_columns(f, columns: dict[str, Optional[str]]) -> Iterator[tuple[str, ...]]:
+    """Yield the given columns of a GTFS csv file as tuples, in the given order.
+
+    Args:
+        f: Binary file object from the GTFS zip
+        columns: Column name -> default when the file lacks that column
+            (None marks a required column; a missing one raises KeyError)
+    """
+    reader = csv.reader(io.TextIOWrapper(f, 'utf-8'))
+    index = {name: i for i, name in enumerate(next(reader, []))}
+    for name, default in columns.items():
+        if default is None and name not in index:
+            raise KeyError(name)
+
+    if all(name in index for name in columns):
+        get = itemgetter(*(index[name] for name in columns))
+        for row in reader:
+            if row:
+                yield get(row)
+    else:
+        positions = [(index.get(name), default) for name, default in columns.items()]
+        for row in reader:
+            if row:
+                yield tuple(row[i] if i is not None else default for i, default in positions)
 
 
 @dataclass
@@ -31,6 +61,8 @@ class GTFSStaticParser:
 
     GTFS_URL = "https://rrgtfsfeeds.s3.amazonaws.com/gtfs_subway.zip"
     GTFS_SUPPLEMENTED_URL = "https://rrgtfsfeeds.s3.amazonaws.com/gtfs_supplemented.zip"
+    # Bump when the cached fields or their layout change
+    CACHE_VERSION = 1
 
     def __init__(self, use_supplemented: bool = False):
         """Initialize the GTFS parser.
@@ -40,17 +72,22 @@ class GTFSStaticParser:
         """
         self.use_supplemented = use_supplemented
         self.gtfs_path = DATA_DIR / "gtfs_subway.zip"
+        # ETag / Last-Modified of the downloaded zip, for conditional re-downloads
+        self.validators_path = DATA_DIR / "gtfs_subway.etag"
         self.stops: dict[str, dict] = {}
         self.routes: dict[str, dict] = {}
         self.trips: dict[str, dict] = {}
-        self.stop_times: list[dict] = []
         self.travel_times: dict[tuple[str, str, str], int] = {}  # (from_stop, to_stop, route) -> seconds
+        # (from_base, to_base) -> fastest seconds on any route, with N/S
+        # direction suffixes stripped; answers any-route lookups
+        self.min_by_pair: dict[tuple[str, str], int] = {}
 
     def download_gtfs(self, force: bool = False) -> bool:
         """Download GTFS static data if not already present.
         
         Args:
-            force: Force re-download even if file exists
+            force: Re-download if the server has a newer file (conditional
+                GET against the saved ETag / Last-Modified)
             
         Returns:
             True if download successful, False otherwise
@@ -63,27 +100,43 @@ class GTFSStaticParser:
         url = self.GTFS_SUPPLEMENTED_URL if self.use_supplemented else self.GTFS_URL
         print(f"Downloading GTFS data from {url}...")
 
+        headers = {}
+        if self.gtfs_path.exists():
+            validators = self._load_validators()
+            if validators.get('url') == url:
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last_modified'):
+                    headers['If-Modified-Since'] = validators['last_modified']
+
         try:
             # Use longer timeout for large file (~10-20MB) and stream for better memory usage
-            response = requests.get(url, timeout=120, stream=True)
-            response.raise_for_status()
-            
-            # Stream download to handle large files better
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(self.gtfs_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
+            with get_http_client().stream("GET", url, headers=headers, timeout=120) as response:
+                if response.status_code == 304:
+                    print("GTFS data is up to date")
+                    return True
+                response.raise_for_status()
+
+                # Stream download to handle large files better
+                total_size = int(response.headers.get('content-length', 0))
+                downloaded = 0
+
+                # Write to a temp file first so a failed download keeps the old zip
+                tmp_path = self.gtfs_path.with_suffix('.tmp')
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_bytes(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                tmp_path.replace(self.gtfs_path)
+                self._save_validators(url, response.headers)
             
             print(f"GTFS data downloaded to {self.gtfs_path} ({downloaded / 1024 / 1024:.1f} MB)")
             return True
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             print(f"Error downloading GTFS data: Request timed out after 120 seconds")
             return False
-        except requests.exceptions.ConnectionError as e:
+        except httpx.ConnectError as e:
             print(f"Error downloading GTFS data: Connection failed - {e}")
             print("  This may indicate network restrictions or firewall rules blocking HTTPS outbound traffic")
             return False
@@ -91,6 +144,25 @@ class GTFSStaticParser:
             print(f"Error downloading GTFS data: {e}")
             return False
 
+    def _load_validators(self) -> dict:
+        """Load the saved ETag / Last-Modified for the downloaded zip."""
+        try:
+            return json.loads(self.validators_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_validators(self, url: str, headers) -> None:
+        """Save the response's ETag / Last-Modified for the next download."""
+        validators = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+        try:
+            self.validators_path.write_text(json.dumps(validators))
+        except OSError as e:
+            print(f"Warning: could not save GTFS ETag: {e}")
+
     def parse_gtfs(self) -> bool:
         """Parse GTFS zip file and extract travel times.
         
@@ -101,6 +173,10 @@ class GTFSStaticParser:
             if not self.download_gtfs():
                 return False
 
+        if self._load_cache():
+            print(f"Loaded cached GTFS data: {len(self.stops)} stops, {len(self.routes)} routes")
+            return True
+
         try:
             with zipfile.ZipFile(self.gtfs_path, 'r') as zf:
                 # Parse stops.txt
@@ -113,11 +189,14 @@ class GTFSStaticParser:
                 self._parse_trips(zf)
                 
                 # Parse stop_times.txt to get travel times
-                self._parse_stop_times(zf)
+                stop_times = self._parse_stop_times(zf)
                 
                 # Calculate travel times between consecutive stops
-                self._calculate_travel_times()
-                
+                self._calculate_travel_times(stop_times)
+                del stop_times
+                self._index_travel_times()
+
+            self._save_cache()
             print(f"Parsed GTFS data: {len(self.stops)} stops, {len(self.routes)} routes")
             return True
         except Exception as e:
@@ -126,18 +205,64 @@ class GTFSStaticParser:
             traceback.print_exc()
             return False
 
+    def _cache_path(self) -> Path:
+        """Path of the parsed-data cache for the current GTFS zip.
+
+        The name includes the zip's mtime and size, so a re-downloaded zip
+        never picks up a stale cache.
+        """
+        stat = self.gtfs_path.stat()
+        return DATA_DIR / f"gtfs_cache_v{self.CACHE_VERSION}_{stat.st_mtime_ns}_{stat.st_size}.pickle"
+
+    def _load_cache(self) -> bool:
+        """Load parsed data from the cache for the current zip, if present."""
+        try:
+            with open(self._cache_path(), 'rb') as f:
+                data = pickle.load(f)
+            self.stops = data['stops']
+            self.routes = data['routes']
+            self.trips = data['trips']
+            self.travel_times = data['travel_times']
+            self.min_by_pair = data['min_by_pair']
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Warning: ignoring unreadable GTFS cache: {e}")
+            return False
+
+    def _save_cache(self):
+        """Write parsed data to the cache and remove caches of older zips."""
+        path = self._cache_path()
+        data = {
+            'stops': self.stops,
+            'routes': self.routes,
+            'trips': self.trips,
+            'travel_times': self.travel_times,
+            'min_by_pair': self.min_by_pair,
+        }
+        try:
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+            for old in DATA_DIR.glob("gtfs_cache_*.pickle"):
+                if old != path:
+                    old.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"Warning: could not write GTFS cache: {e}")
+
     def _parse_stops(self, zf: zipfile.ZipFile):
         """Parse stops.txt file."""
         try:
             with zf.open('stops.txt') as f:
-                reader = csv.DictReader(io.TextIOWrapper(f, 'utf-8'))
-                for row in reader:
-                    stop_id = row['stop_id']
+                columns = {'stop_id': None, 'stop_name': '', 'stop_lat': '0', 'stop_lon': '0'}
+                for stop_id, stop_name, stop_lat, stop_lon in _read_columns(f, columns):
                     self.stops[stop_id] = {
                         'stop_id': stop_id,
-                        'stop_name': row.get('stop_name', ''),
-                        'stop_lat': float(row.get('stop_lat', 0)),
-                        'stop_lon': float(row.get('stop_lon', 0)),
+                        'stop_name': stop_name,
+                        'stop_lat': float(stop_lat),
+                        'stop_lon': float(stop_lon),
                     }
         except KeyError:
             print("Warning: stops.txt not found in GTFS zip")
@@ -146,14 +271,13 @@ class GTFSStaticParser:
         """Parse routes.txt file."""
         try:
             with zf.open('routes.txt') as f:
-                reader = csv.DictReader(io.TextIOWrapper(f, 'utf-8'))
-                for row in reader:
-                    route_id = row['route_id']
+                columns = {'route_id': None, 'route_short_name': '', 'route_long_name': '', 'route_type': '1'}
+                for route_id, short_name, long_name, route_type in _read_columns(f, columns):
                     self.routes[route_id] = {
                         'route_id': route_id,
-                        'route_short_name': row.get('route_short_name', ''),
-                        'route_long_name': row.get('route_long_name', ''),
-                        'route_type': int(row.get('route_type', 1)),
+                        'route_short_name': short_name,
+                        'route_long_name': long_name,
+                        'route_type': int(route_type),
                     }
         except KeyError:
             print("Warning: routes.txt not found in GTFS zip")
@@ -162,34 +286,61 @@ class GTFSStaticParser:
         """Parse trips.txt file."""
         try:
             with zf.open('trips.txt') as f:
-                reader = csv.DictReader(io.TextIOWrapper(f, 'utf-8'))
-                for row in reader:
-                    trip_id = row['trip_id']
+                columns = {
+                    'trip_id': None, 'route_id': '', 'service_id': '',
+                    'trip_headsign': '', 'direction_id': '',
+                }
+                for trip_id, route_id, service_id, headsign, direction_id in _read_columns(f, columns):
                     self.trips[trip_id] = {
                         'trip_id': trip_id,
-                        'route_id': row.get('route_id', ''),
-                        'service_id': row.get('service_id', ''),
-                        'trip_headsign': row.get('trip_headsign', ''),
-                        'direction_id': row.get('direction_id', ''),
+                        'route_id': route_id,
+                        'service_id': service_id,
+                        'trip_headsign': headsign,
+                        'direction_id': direction_id,
                     }
         except KeyError:
             print("Warning: trips.txt not found in GTFS zip")
 
-    def _parse_stop_times(self, zf: zipfile.ZipFile):
-        """Parse stop_times.txt file."""
+    def _parse_stop_times(self, zf: zipfile.ZipFile) -> list[tuple[str, Optional[int], Optional[int], str, int]]:
+        """Parse stop_times.txt file into (trip_id, arrival, departure, stop_id, sequence) tuples.
+
+        Arrival and departure are converted to seconds since midnight (None
+        when invalid). Rows of trips without a known route are dropped, as
+        they can't contribute travel times.
+        """
+        stop_times: list[tuple[str, Optional[int], Optional[int], str, int]] = []
+        routed_trips = {trip_id for trip_id, trip in self.trips.items() if trip['route_id']}
         try:
             with zf.open('stop_times.txt') as f:
-                reader = csv.DictReader(io.TextIOWrapper(f, 'utf-8'))
-                for row in reader:
-                    self.stop_times.append({
-                        'trip_id': row['trip_id'],
-                        'arrival_time': row.get('arrival_time', ''),
-                        'departure_time': row.get('departure_time', ''),
-                        'stop_id': row['stop_id'],
-                        'stop_sequence': int(row.get('stop_sequence', 0)),
-                    })
+                columns = {
+                    'trip_id': None, 'arrival_time': '', 'departure_time': '',
+                    'stop_id': None, 'stop_sequence': '0',
+                }
+                intern = sys.intern
+                append = stop_times.append
+                # The whole feed uses only a few thousand distinct time
+                # strings, so convert each one once
+                seconds: dict[str, Optional[int]] = {}
+
+                def to_seconds(time_str: str) -> Optional[int]:
+                    try:
+                        return seconds[time_str]
+                    except KeyError:
+                        value = seconds[time_str] = self._time_to_seconds(time_str)
+                        return value
+
+                for trip_id, arrival, departure, stop_id, sequence in _read_columns(f, columns):
+                    if trip_id not in routed_trips:
+                        continue
+                    # ~500k rows share a few thousand trip/stop ids; intern
+                    # them so equal ids are one string object
+                    append((
+                        intern(trip_id), to_seconds(arrival), to_seconds(departure),
+                        intern(stop_id), int(sequence),
+                    ))
         except KeyError:
             print("Warning: stop_times.txt not found in GTFS zip")
+        return stop_times
 
     def _time_to_seconds(self, time_str: str) -> Optional[int]:
         """Convert HH:MM:SS time string to seconds since midnight.
@@ -209,53 +360,59 @@ class GTFSStaticParser:
         except (ValueError, IndexError):
             return None
 
-    def _calculate_travel_times(self):
-        """Calculate travel times between consecutive stops for each trip."""
-        # Group stop_times by trip_id
-        trips_stops: dict[str, list[dict]] = defaultdict(list)
-        for stop_time in self.stop_times:
-            trips_stops[stop_time['trip_id']].append(stop_time)
+    def _calculate_travel_times(self, stop_times: list[tuple]):
+        """Calculate travel times between consecutive stops for each trip.
 
-        # Sort by stop_sequence for each trip
-        for trip_id, stops in trips_stops.items():
-            stops.sort(key=lambda x: x['stop_sequence'])
-
-        # Calculate travel times between consecutive stops
-        for trip_id, stops in trips_stops.items():
-            if trip_id not in self.trips:
-                continue
-            
-            route_id = self.trips[trip_id]['route_id']
-            if not route_id:
+        Args:
+            stop_times: Rows from _parse_stop_times; sorted in place
+        """
+        # Order rows by (trip_id, stop_sequence) so each trip's stops are
+        # contiguous; the feed is already nearly in this order, which the
+        # sort handles in close to linear time
+        stop_times.sort(key=itemgetter(0, 4))
+
+        trips = self.trips
+        travel_times = self.travel_times
+
+        # Walk consecutive row pairs, skipping pairs that span two trips
+        for from_stop, to_stop in pairwise(stop_times):
+            trip_id = from_stop[0]
+            if trip_id != to_stop[0]:
                 continue
+            route_id = trips[trip_id]['route_id']
 
-            for i in range(len(stops) - 1):
-                from_stop = stops[i]
-                to_stop = stops[i + 1]
+            from_time = from_stop[2]
+            to_time = to_stop[1]
 
-                from_time = self._time_to_seconds(from_stop['departure_time'])
-                to_time = self._time_to_seconds(to_stop['arrival_time'])
+            if from_time is None or to_time is None:
+                continue
+
+            # Handle times that cross midnight (next day)
+            if to_time < from_time:
+                to_time += 24 * 3600
 
-                if from_time is None or to_time is None:
-                    continue
+            travel_seconds = to_time - from_time
 
-                # Handle times that cross midnight (next day)
-                if to_time < from_time:
-                    to_time += 24 * 3600
+            # Skip unrealistic travel times (> 30 minutes between consecutive stops)
+            if travel_seconds < 0 or travel_seconds > 1800:
+                continue
 
-                travel_seconds = to_time - from_time
+            key = (from_stop[3], to_stop[3], route_id)
 
-                # Skip unrealistic travel times (> 30 minutes between consecutive stops)
-                if travel_seconds < 0 or travel_seconds > 1800:
-                    continue
+            # Store minimum travel time for this route (most efficient)
+            best = travel_times.get(key)
+            if best is None or travel_seconds < best:
+                travel_times[key] = travel_seconds
 
-                key = (from_stop['stop_id'], to_stop['stop_id'], route_id)
-                
-                # Store minimum travel time for this route (most efficient)
-                if key not in self.travel_times:
-                    self.travel_times[key] = travel_seconds
-                else:
-                    self.travel_times[key] = min(self.travel_times[key], travel_seconds)
+    def _index_travel_times(self):
+        """Precompute the fastest time per direction-less stop pair across routes."""
+        min_by_pair: dict[tuple[str, str], int] = {}
+        for (from_stop, to_stop, _), time_sec in self.travel_times.items():
+            pair = (from_stop.rstrip('NS'), to_stop.rstrip('NS'))
+            best = min_by_pair.get(pair)
+            if best is None or time_sec < best:
+                min_by_pair[pair] = time_sec
+        self.min_by_pair = min_by_pair
 
     def get_travel_time(
         self, 
@@ -290,15 +447,9 @@ class GTFSStaticParser:
             
             return None
         else:
-            # Find minimum travel time across all routes
-            min_time = None
-            for (f, t, r), time_sec in self.travel_times.items():
-                f_base = f.rstrip('NS')
-                t_base = t.rstrip('NS')
-                if (f_base == from_base and t_base == to_base) or (f == from_stop_id and t == to_stop_id):
-                    if min_time is None or time_sec < min_time:
-                        min_time = time_sec
-            return min_time
+            # Find minimum travel time across all routes. An exact id match
+            # always implies a base-id match, so the base pair covers both.
+            return self.min_by_pair.get((from_base, to_base))
 
     def get_travel_time_minutes(
         self,
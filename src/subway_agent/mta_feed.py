@@ -2,19 +2,59 @@
 
 from __future__ import annotations
 
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
+from operator import attrgetter
 from typing import Optional
 
-import requests
 from google.transit import gtfs_realtime_pb2
 
-from .config import MTA_FEEDS, LINE_TO_FEED, MTA_API_KEY
+from .config import MTA_FEEDS, LINE_TO_FEED, MTA_API_KEY, get_http_client
 from .stations import STATIONS, Station
 
 
-@dataclass
+def _protobuf_backend() -> str:
+    """Name of the protobuf runtime in use ("upb", "cpp" or "python")."""
+    try:
+        from google.protobuf.internal import api_implementation
+        return api_implementation.Type()
+    except Exception:
+        return "unknown"
+
+
+# Feed decoding is many times slower on the pure-Python runtime, which is
+# only used when forced (PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=python) or
+# when protobuf is too old to ship a compiled backend (< 4.21)
+if _protobuf_backend() == "python":
+    print(
+        "Warning: protobuf is using its pure-Python implementation; real-time feed "
+        "parsing will be slow. Install protobuf>=4.21 and unset "
+        "PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION to use the compiled backend."
+    )
+
+# Feeds a station needs are fetched in parallel on this pool; MTA has 8
+# feeds, so a busy transfer station touches at most a handful at once
+_FEED_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mta-feed")
+
+# GTFS stop ID (without direction) -> station; the first station listed
+# wins if two share an ID
+_GTFS_ID_TO_STATION: dict[str, Station] = {}
+for _station in STATIONS.values():
+    _GTFS_ID_TO_STATION.setdefault(_station.gtfs_stop_id, _station)
+del _station
+
+# Direction suffix -> direction; stop IDs without one map to ""
+_DIRECTION_SUFFIXES = {"N": "N", "S": "S"}
+
+# Raw stop ID -> (GTFS stop ID, direction); the set of stop IDs is small
+# and fixed, so each one is split only once per process
+_PARSED_STOP_IDS: dict[str, tuple[str, str]] = {}
+
+
+@dataclass(slots=True)
 class TrainArrival:
     """Represents a train arrival at a station."""
     line: str
@@ -24,6 +64,7 @@ class TrainArrival:
     arrival_time: datetime
     minutes_until: int
     trip_id: str
+    arrival_ts: int  # arrival_time as a Unix timestamp, used for sorting
 
     def __str__(self):
         direction_label = "Uptown" if self.direction == "N" else "Downtown"
@@ -34,51 +75,156 @@ class MTAFeedParser:
     """Parser for MTA GTFS-realtime feeds."""
 
     def __init__(self):
-        self._cache: dict[str, tuple[float, any]] = {}
+        # feed_url -> (fetched_at, feed, etag, last_modified); entries outlive
+        # the TTL so the next fetch can revalidate them with a conditional GET
+        self._cache: dict[str, tuple[float, any, Optional[str], Optional[str]]] = {}
         self._cache_ttl = 30  # seconds
-
-    def _fetch_feed(self, feed_url: str) -> Optional[gtfs_realtime_pb2.FeedMessage]:
-        """Fetch and parse a GTFS-realtime feed."""
-        # Check cache
+        # feed_url -> result of the fetch in progress; concurrent callers
+        # for the same feed wait on it instead of issuing their own request
+        self._inflight: dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        # feed_url -> (feed, its stop index); see _stop_index
+        self._stop_indexes: dict[str, tuple[gtfs_realtime_pb2.FeedMessage, dict]] = {}
+
+    def _get_cached(self, feed_url: str) -> Optional[gtfs_realtime_pb2.FeedMessage]:
+        """Return the cached feed if it is still fresh."""
         if feed_url in self._cache:
-            cached_time, cached_data = self._cache[feed_url]
+            cached_time, cached_data, _, _ = self._cache[feed_url]
             if time.time() - cached_time < self._cache_ttl:
                 return cached_data
+        return None
 
+    def _fetch_feed(self, feed_url: str) -> Optional[gtfs_realtime_pb2.FeedMessage]:
+        """Fetch and parse a GTFS-realtime feed."""
+        # Check cache
+        cached = self._get_cached(feed_url)
+        if cached is not None:
+            return cached
+
+        with self._inflight_lock:
+            # Another thread may have finished the fetch since the check above
+            cached = self._get_cached(feed_url)
+            if cached is not None:
+                return cached
+            future = self._inflight.get(feed_url)
+            leader = future is None
+            if leader:
+                future = self._inflight[feed_url] = Future()
+
+        if not leader:
+            return future.result()
+
+        feed = None
+        try:
+            feed = self._download_feed(feed_url)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[feed_url]
+            future.set_result(feed)
+        return feed
+
+    def _download_feed(self, feed_url: str) -> Optional[gtfs_realtime_pb2.FeedMessage]:
+        """Request and parse a GTFS-realtime feed, caching it on success."""
         try:
             headers = {}
             if MTA_API_KEY:
                 headers["x-api-key"] = MTA_API_KEY
-            response = requests.get(feed_url, timeout=10, headers=headers)
+            cached = self._cache.get(feed_url)
+            if cached:
+                _, cached_feed, etag, last_modified = cached
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+            response = get_http_client().get(feed_url, timeout=10, headers=headers)
+
+            if response.status_code == 304 and cached:
+                # Unchanged since the last fetch; keep the parsed feed
+                self._cache[feed_url] = (time.time(), cached_feed, etag, last_modified)
+                return cached_feed
             response.raise_for_status()
 
             feed = gtfs_realtime_pb2.FeedMessage()
             feed.ParseFromString(response.content)
 
             # Cache the result
-            self._cache[feed_url] = (time.time(), feed)
+            self._cache[feed_url] = (
+                time.time(), feed, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+            )
             return feed
 
         except Exception as e:
             print(f"Error fetching MTA feed: {e}")
             return None
 
+    def _fetch_feeds(self, feed_urls) -> list[Optional[gtfs_realtime_pb2.FeedMessage]]:
+        """Fetch several feeds, requesting the uncached ones in parallel."""
+        feed_urls = [url for url in feed_urls if url]
+        stale = [url for url in feed_urls if self._get_cached(url) is None]
+        fetched = {}
+        if len(stale) > 1:
+            fetched = dict(zip(stale, _FEED_EXECUTOR.map(self._fetch_feed, stale)))
+        return [fetched[url] if url in fetched else self._fetch_feed(url) for url in feed_urls]
+
+    def _stop_index(
+        self, feed_url: str, feed: gtfs_realtime_pb2.FeedMessage
+    ) -> dict[str, list[tuple[str, str, int, str]]]:
+        """Index a feed's stop time updates by GTFS stop ID (without direction).
+
+        Built once per fetched feed, so station lookups read only their own
+        updates instead of walking every trip in the feed.
+
+        Returns:
+            Dict mapping stop ID -> [(route_id, direction, timestamp, trip_id)]
+            in feed order
+        """
+        cached = self._stop_indexes.get(feed_url)
+        if cached is not None and cached[0] is feed:
+            return cached[1]
+
+        index: dict[str, list[tuple[str, str, int, str]]] = {}
+        for entity in feed.entity:
+            if not entity.HasField("trip_update"):
+                continue
+
+            trip_update = entity.trip_update
+            route_id = trip_update.trip.route_id
+            trip_id = trip_update.trip.trip_id
+
+            for stop_time_update in trip_update.stop_time_update:
+                # Unset time fields read as 0; an arrival that carries only
+                # a delay falls back to the departure time
+                arrival_timestamp = stop_time_update.arrival.time or stop_time_update.departure.time
+                if not arrival_timestamp:
+                    continue
+
+                gtfs_stop_id, direction = self._parse_stop_id(stop_time_update.stop_id)
+                entry = (route_id, direction, arrival_timestamp, trip_id)
+                stop_updates = index.get(gtfs_stop_id)
+                if stop_updates is None:
+                    index[gtfs_stop_id] = [entry]
+                else:
+                    stop_updates.append(entry)
+
+        self._stop_indexes[feed_url] = (feed, index)
+        return index
+
     def _parse_stop_id(self, stop_id: str) -> tuple[str, str]:
         """Parse GTFS stop ID into station ID and direction.
 
         GTFS stop IDs are formatted as: {stop_id}{direction}
         e.g., "142N" = South Ferry, Northbound
         """
-        if stop_id and stop_id[-1] in ("N", "S"):
-            return stop_id[:-1], stop_id[-1]
-        return stop_id, ""
+        parsed = _PARSED_STOP_IDS.get(stop_id)
+        if parsed is None:
+            direction = _DIRECTION_SUFFIXES.get(stop_id[-1:], "")
+            parsed = (stop_id[:-1], direction) if direction else (stop_id, "")
+            _PARSED_STOP_IDS[stop_id] = parsed
+        return parsed
 
     def _find_station_by_gtfs_id(self, gtfs_id: str) -> Optional[Station]:
         """Find station by GTFS stop ID."""
-        for station in STATIONS.values():
-            if station.gtfs_stop_id == gtfs_id:
-                return station
-        return None
+        return _GTFS_ID_TO_STATION.get(gtfs_id)
 
     def get_arrivals_for_station(
         self, station_id: str, lines: Optional[list[str]] = None
@@ -97,67 +243,47 @@ class MTAFeedParser:
             return []
 
         arrivals = []
-        now = datetime.now()
+        now_ts = datetime.now().timestamp()
 
         # Determine which feeds to query
         if lines:
-            feed_urls = set(LINE_TO_FEED.get(line.upper()) for line in lines if line.upper() in LINE_TO_FEED)
+            feed_urls = {LINE_TO_FEED.get(line.upper()) for line in lines}
         else:
-            feed_urls = set(LINE_TO_FEED.get(line) for line in station.lines if line in LINE_TO_FEED)
+            feed_urls = {LINE_TO_FEED.get(line) for line in station.lines}
 
-        for feed_url in feed_urls:
-            if not feed_url:
-                continue
+        feed_urls = [url for url in feed_urls if url]
+        wanted_lines = frozenset(l.upper() for l in lines) if lines else None
 
-            feed = self._fetch_feed(feed_url)
+        for feed_url, feed in zip(feed_urls, self._fetch_feeds(feed_urls)):
             if not feed:
                 continue
 
-            for entity in feed.entity:
-                if not entity.HasField("trip_update"):
+            stop_updates = self._stop_index(feed_url, feed).get(station.gtfs_stop_id, ())
+            for route_id, direction, arrival_timestamp, trip_id in stop_updates:
+                # Filter by requested lines
+                if wanted_lines is not None and route_id not in wanted_lines:
                     continue
 
-                trip_update = entity.trip_update
-                route_id = trip_update.trip.route_id
-
-                # Filter by requested lines
-                if lines and route_id not in [l.upper() for l in lines]:
+                # Only include future arrivals; the datetime is built only
+                # for updates that pass
+                minutes_until = int((arrival_timestamp - now_ts) / 60)
+                if minutes_until < 0:
                     continue
+                arrival_time = datetime.fromtimestamp(arrival_timestamp)
 
-                for stop_time_update in trip_update.stop_time_update:
-                    gtfs_stop_id, direction = self._parse_stop_id(stop_time_update.stop_id)
-
-                    # Check if this is the station we're looking for
-                    if gtfs_stop_id != station.gtfs_stop_id:
-                        continue
-
-                    # Get arrival time
-                    if stop_time_update.HasField("arrival"):
-                        arrival_timestamp = stop_time_update.arrival.time
-                    elif stop_time_update.HasField("departure"):
-                        arrival_timestamp = stop_time_update.departure.time
-                    else:
-                        continue
-
-                    arrival_time = datetime.fromtimestamp(arrival_timestamp)
-                    minutes_until = int((arrival_time - now).total_seconds() / 60)
-
-                    # Only include future arrivals
-                    if minutes_until < 0:
-                        continue
-
-                    arrivals.append(TrainArrival(
-                        line=route_id,
-                        station_id=station_id,
-                        station_name=station.name,
-                        direction=direction,
-                        arrival_time=arrival_time,
-                        minutes_until=minutes_until,
-                        trip_id=trip_update.trip.trip_id,
-                    ))
+                arrivals.append(TrainArrival(
+                    line=route_id,
+                    station_id=station_id,
+                    station_name=station.name,
+                    direction=direction,
+                    arrival_time=arrival_time,
+                    minutes_until=minutes_until,
+                    trip_id=trip_id,
+                    arrival_ts=arrival_timestamp,
+                ))
 
         # Sort by arrival time
-        arrivals.sort(key=lambda a: a.arrival_time)
+        arrivals.sort(key=attrgetter("arrival_ts"))
         return arrivals
 
     def get_arrivals_for_line(self, line: str, limit: int = 10) -> dict[str, list[TrainArrival]]:
@@ -176,7 +302,8 @@ class MTAFeedParser:
             return {}
 
         arrivals_by_station: dict[str, list[TrainArrival]] = {}
-        now = datetime.now()
+        now_ts = datetime.now().timestamp()
+        station_for_stop = _GTFS_ID_TO_STATION.get
 
         for entity in feed.entity:
             if not entity.HasField("trip_update"):
@@ -190,23 +317,21 @@ class MTAFeedParser:
 
             for stop_time_update in trip_update.stop_time_update:
                 gtfs_stop_id, direction = self._parse_stop_id(stop_time_update.stop_id)
-                station = self._find_station_by_gtfs_id(gtfs_stop_id)
+                station = station_for_stop(gtfs_stop_id)
 
                 if not station:
                     continue
 
-                if stop_time_update.HasField("arrival"):
-                    arrival_timestamp = stop_time_update.arrival.time
-                elif stop_time_update.HasField("departure"):
-                    arrival_timestamp = stop_time_update.departure.time
-                else:
+                # Unset time fields read as 0; an arrival that carries only
+                # a delay falls back to the departure time
+                arrival_timestamp = stop_time_update.arrival.time or stop_time_update.departure.time
+                if not arrival_timestamp:
                     continue
 
-                arrival_time = datetime.fromtimestamp(arrival_timestamp)
-                minutes_until = int((arrival_time - now).total_seconds() / 60)
-
+                minutes_until = int((arrival_timestamp - now_ts) / 60)
                 if minutes_until < 0:
                     continue
+                arrival_time = datetime.fromtimestamp(arrival_timestamp)
 
                 if station.id not in arrivals_by_station:
                     arrivals_by_station[station.id] = []
@@ -219,11 +344,13 @@ class MTAFeedParser:
                     arrival_time=arrival_time,
                     minutes_until=minutes_until,
                     trip_id=trip_update.trip.trip_id,
+                    arrival_ts=arrival_timestamp,
                 ))
 
         # Sort arrivals at each station
+        by_arrival = attrgetter("arrival_ts")
         for station_id in arrivals_by_station:
-            arrivals_by_station[station_id].sort(key=lambda a: a.arrival_time)
+            arrivals_by_station[station_id].sort(key=by_arrival)
             arrivals_by_station[station_id] = arrivals_by_station[station_id][:limit]
 
         return arrivals_by_station
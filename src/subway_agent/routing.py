@@ -3,15 +3,16 @@
 from __future__ import annotations
 
 import heapq
-from collections import deque
+import threading
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
 from .stations import STATIONS, Station, find_station
 from .gtfs_static import get_gtfs_parser
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class RouteSegment:
     """A segment of a subway route on one line."""
     line: str
@@ -24,7 +25,7 @@ class RouteSegment:
         return f"Take {self.line} from {self.from_station.name} to {self.to_station.name} ({len(self.stops)-1} stops, ~{self.travel_time_minutes} min)"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Route:
     """A complete route with possible transfers."""
     segments: list[RouteSegment]
@@ -42,6 +43,11 @@ class Route:
 # Average travel time between stations (in minutes) - fallback if GTFS data unavailable
 AVG_TIME_BETWEEN_STOPS = 2
 TRANSFER_TIME = 5  # minutes to transfer between lines
+# Routes kept for repeat queries outside the warmed popular pairs
+ROUTE_LRU_SIZE = 4096
+# Bits reserved for the transfer count in packed route-search costs; far
+# more than a route through the whole network could use
+_TRANSFER_BITS = 16
 
 # Line connections - which stations connect which lines
 # Format: {station_id: [lines]}
@@ -225,6 +231,24 @@ class SubwayGraph:
 
     def __init__(self):
         self.adjacency: dict[str, list[tuple[str, str, int]]] = {}  # station_id -> [(neighbor_id, line, time)]
+        # Precomputed routes for frequently requested (from_id, to_id) pairs;
+        # see warm_route_cache
+        self._route_cache: dict[tuple[str, str], Optional[Route]] = {}
+        # Every other search, least recently used evicted first; the graph
+        # never changes after construction, so entries don't go stale
+        self._search_route_cached = lru_cache(maxsize=ROUTE_LRU_SIZE)(self._search_route)
+        # Per line: station_id -> position in LINE_SEQUENCES[line], and
+        # cumulative segment seconds along the line in each direction
+        # (see _calculate_segment_time)
+        self._line_index: dict[str, dict[str, int]] = {}
+        self._cum_forward: dict[str, list[int]] = {}
+        self._cum_backward: dict[str, list[int]] = {}
+        # (from_id, to_id, line) -> segment seconds, for lookups the tables don't cover
+        self._edge_seconds_cache: dict[tuple[str, str, str], int] = {}
+        # Per line: station_id -> (connected run of the line, position,
+        # cumulative edge minutes forward, cumulative edge minutes backward);
+        # see get_travel_time_on_line
+        self._line_minutes: dict[str, dict[str, tuple[int, int, int, int]]] = {}
         self.gtfs_parser = None
         try:
             self.gtfs_parser = get_gtfs_parser()
@@ -253,29 +277,126 @@ class SubwayGraph:
         # Add transfer edges
         self._add_transfers()
 
+        if self.gtfs_parser:
+            self._build_line_tables()
+
+        self._build_line_minutes()
+        self._build_state_keys()
+
+    def _build_line_minutes(self):
+        """Precompute cumulative graph edge minutes along each line, both directions.
+
+        A line's stations split into runs where a station is missing from
+        STATIONS (no edge there); travel stays within one run.
+        """
+        edge_time = {
+            (from_id, to_id, line): time
+            for from_id, edges in self.adjacency.items()
+            for to_id, line, time in edges
+        }
+        for line, stations in LINE_SEQUENCES.items():
+            table: dict[str, tuple[int, int, int, int]] = {}
+            run = forward = backward = 0
+            previous = None
+            for position, station_id in enumerate(stations):
+                if station_id not in STATIONS:
+                    run += 1
+                    previous = None
+                    continue
+                if previous is not None:
+                    forward += edge_time[(previous, station_id, line)]
+                    backward += edge_time[(station_id, previous, line)]
+                table[station_id] = (run, position, forward, backward)
+                previous = station_id
+            self._line_minutes[line] = table
+
+    def _build_state_keys(self):
+        """Number stations and lines in sorted order for the route search.
+
+        A (station, line) state is packed into one int as
+        station_rank << line_bits | line_rank, so comparing two state ints
+        orders them the same as comparing the (station_id, line) tuples.
+        """
+        lines = set(LINE_SEQUENCES)
+        for station in STATIONS.values():
+            lines.update(station.lines)
+        self._station_ids = sorted(set(STATIONS) | set(self.adjacency))
+        self._line_ids = sorted(lines)
+        self._station_rank = {station_id: i for i, station_id in enumerate(self._station_ids)}
+        self._line_rank = {line: i for i, line in enumerate(self._line_ids)}
+        self._line_bits = max(len(self._line_ids) - 1, 1).bit_length()
+        self._state_bits = max(len(self._station_ids) - 1, 1).bit_length() + self._line_bits
+
+        # adjacency re-keyed for the search, per state: state -> [(neighbor
+        # state, cost)], where cost is edge time << _TRANSFER_BITS plus the
+        # transfer penalty when the edge's line differs from the state's.
+        # Only states the search can reach get edges: a station's own lines
+        # (the origin states) and the lines of edges arriving there.
+        transfer_cost = (TRANSFER_TIME << _TRANSFER_BITS) + 1
+        state_lines: dict[str, set[str]] = {
+            station_id: set(STATIONS[station_id].lines) if station_id in STATIONS else set()
+            for station_id in self._station_ids
+        }
+        for edges in self.adjacency.values():
+            for neighbor, line, _ in edges:
+                state_lines[neighbor].add(line)
+
+        self._state_edges: list[tuple[tuple[int, int], ...]] = [()] * (1 << self._state_bits)
+        for station_id, lines in state_lines.items():
+            origin = self._station_rank[station_id] << self._line_bits
+            edges = self.adjacency.get(station_id, ())
+            for current_line in lines:
+                self._state_edges[origin | self._line_rank[current_line]] = tuple(
+                    (
+                        self._station_rank[neighbor] << self._line_bits | self._line_rank[line],
+                        (time << _TRANSFER_BITS) + (transfer_cost if line != current_line else 0),
+                    )
+                    for neighbor, line, time in edges
+                )
+
+    def _build_line_tables(self):
+        """Precompute cumulative travel seconds along each line, both directions."""
+        for line, stations in LINE_SEQUENCES.items():
+            forward = [0]
+            backward = [0]
+            for from_id, to_id in zip(stations, stations[1:]):
+                if from_id in STATIONS and to_id in STATIONS:
+                    forward.append(forward[-1] + self._edge_seconds(STATIONS[from_id], STATIONS[to_id], line))
+                    backward.append(backward[-1] + self._edge_seconds(STATIONS[to_id], STATIONS[from_id], line))
+                else:
+                    # No edge here, so no segment spans it; keep positions aligned
+                    forward.append(forward[-1])
+                    backward.append(backward[-1])
+            self._line_index[line] = {station_id: i for i, station_id in enumerate(stations)}
+            self._cum_forward[line] = forward
+            self._cum_backward[line] = backward
+
+    def _edge_seconds(self, from_station: Station, to_station: Station, line: str) -> int:
+        """Seconds between two consecutive stations on a line, from GTFS or the estimate."""
+        key = (from_station.id, to_station.id, line)
+        seconds = self._edge_seconds_cache.get(key)
+        if seconds is None:
+            seconds = self.gtfs_parser.get_travel_time(
+                from_station.gtfs_stop_id,
+                to_station.gtfs_stop_id,
+                route_id=line
+            )
+            if seconds is None:
+                # Fallback to estimate for this segment
+                seconds = AVG_TIME_BETWEEN_STOPS * 60
+            self._edge_seconds_cache[key] = seconds
+        return seconds
+
     def _add_edge(self, from_id: str, to_id: str, line: str, time: Optional[int] = None):
         """Add an edge to the graph with travel time from GTFS or estimate."""
         if from_id not in self.adjacency:
             self.adjacency[from_id] = []
         
-        # Try to get real travel time from GTFS
+        # Try to get real travel time from GTFS; _edge_seconds memoizes the
+        # lookup, so the line tables built afterwards reuse it
         if time is None:
             if self.gtfs_parser and from_id in STATIONS and to_id in STATIONS:
-                from_station = STATIONS[from_id]
-                to_station = STATIONS[to_id]
-                
-                # Try to get travel time for this specific route
-                travel_minutes = self.gtfs_parser.get_travel_time_minutes(
-                    from_station.gtfs_stop_id,
-                    to_station.gtfs_stop_id,
-                    route_id=line
-                )
-                
-                if travel_minutes is not None:
-                    time = travel_minutes
-                else:
-                    # Fallback to estimate
-                    time = AVG_TIME_BETWEEN_STOPS
+                time = round(self._edge_seconds(STATIONS[from_id], STATIONS[to_id], line) / 60)
             else:
                 time = AVG_TIME_BETWEEN_STOPS
         
@@ -292,50 +413,131 @@ class SubwayGraph:
 
     def find_route(self, from_station_id: str, to_station_id: str) -> Optional[Route]:
         """Find the best route between two stations using modified Dijkstra."""
+        route_cache = self._route_cache
+        key = (from_station_id, to_station_id)
+        if key in route_cache:
+            return route_cache[key]
+        return self._search_route_cached(from_station_id, to_station_id)
+
+    def warm_route_cache(self, pairs: list[tuple[str, str]]):
+        """Precompute routes for the given (from_id, to_id) pairs.
+
+        Replaces the previous set of cached pairs; routes already computed
+        are reused since the graph doesn't change.
+        """
+        old = self._route_cache
+        new = {}
+        for pair in pairs:
+            new[pair] = old[pair] if pair in old else self._search_route_cached(*pair)
+        self._route_cache = new
+
+    def _search_route(self, from_station_id: str, to_station_id: str) -> Optional[Route]:
+        """Run the route search for find_route."""
         if from_station_id not in self.adjacency or to_station_id not in self.adjacency:
             return None
 
-        # Priority queue: (total_time, transfers, current_station, current_line, path)
-        # path is list of (station_id, line)
         start_station = STATIONS.get(from_station_id)
         if not start_station:
             return None
 
+        # Dijkstra over (station, line) states. States are packed ints (see
+        # _build_state_keys) and queue entries are single ints,
+        # ((time << TRANSFER_BITS | transfers) << state_bits) | state, which
+        # sort like (time, transfers, station_id, line) tuples. Each state's
+        # path is rebuilt from prev once the destination is reached.
+        station_rank = self._station_rank
+        line_rank = self._line_rank
+        state_edges = self._state_edges
+        line_bits = self._line_bits
+        state_bits = self._state_bits
+        state_mask = (1 << state_bits) - 1
+        target = station_rank[to_station_id]
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+
+        pq: list[int] = []
+        best: dict[int, int] = {}  # state -> time << _TRANSFER_BITS | transfers
+        prev: dict[int, Optional[int]] = {}
+        depth: dict[int, int] = {}
+
         # Start with all possible lines at the origin
-        pq = []
+        origin = station_rank[from_station_id] << line_bits
         for line in start_station.lines:
-            heapq.heappush(pq, (0, 0, from_station_id, line, [(from_station_id, line)]))
+            state = origin | line_rank[line]
+            if state not in best:
+                best[state] = 0
+                prev[state] = None
+                depth[state] = 0
+            heappush(pq, state)
 
         visited = set()
 
         while pq:
-            time, transfers, current, current_line, path = heapq.heappop(pq)
+            key = heappop(pq)
+            state = key & state_mask
+            cost = key >> state_bits
 
-            if current == to_station_id:
-                return self._build_route(path)
+            if state >> line_bits == target:
+                return self._build_route(self._path_to(state, prev))
 
-            state = (current, current_line)
             if state in visited:
                 continue
             visited.add(state)
 
-            for neighbor, edge_line, edge_time in self.adjacency.get(current, []):
-                # Calculate cost
-                new_time = time + edge_time
-                new_transfers = transfers
-
-                # Penalty for changing lines
-                if edge_line != current_line:
-                    new_time += TRANSFER_TIME
-                    new_transfers += 1
+            # Edge costs already include the penalty for changing lines
+            # (time and one transfer); see _build_state_keys
+            for new_state, edge_cost in state_edges[state]:
+                new_cost = cost + edge_cost
 
-                new_state = (neighbor, edge_line)
-                if new_state not in visited:
-                    new_path = path + [(neighbor, edge_line)]
-                    heapq.heappush(pq, (new_time, new_transfers, neighbor, edge_line, new_path))
+                if new_state in visited:
+                    continue
+                known = best.get(new_state)
+                if known is None or new_cost < known:
+                    best[new_state] = new_cost
+                    prev[new_state] = state
+                    depth[new_state] = depth[state] + 1
+                    heappush(pq, new_cost << state_bits | new_state)
+                elif new_cost == known and self._path_precedes(state, prev[new_state], prev, depth):
+                    # Equal cost: keep the lexicographically smaller path,
+                    # the one the queue would pop first if it held paths
+                    prev[new_state] = state
+                    depth[new_state] = depth[state] + 1
 
         return None
 
+    @staticmethod
+    def _path_precedes(a, b, prev, depth) -> bool:
+        """Whether the path to state a sorts before the path to state b.
+
+        Same result as _path_to(a, prev) < _path_to(b, prev), but only walks
+        back to where the two paths diverge.
+        """
+        a_below = b_below = None
+        a_depth, b_depth = depth[a], depth[b]
+        while a_depth > b_depth:
+            a_below, a = a, prev[a]
+            a_depth -= 1
+        while b_depth > a_depth:
+            b_below, b = b, prev[b]
+            b_depth -= 1
+        if a == b:
+            # One path is a prefix of the other; the shorter one sorts first
+            return a_below is None and b_below is not None
+        while prev[a] != prev[b]:
+            a, b = prev[a], prev[b]
+        return a < b
+
+    def _path_to(self, state: int, prev: dict[int, Optional[int]]) -> list[tuple[str, str]]:
+        """Follow predecessor links back from a state; returns [(station_id, line)] from the origin."""
+        line_bits = self._line_bits
+        line_mask = (1 << line_bits) - 1
+        path = []
+        while state is not None:
+            path.append((self._station_ids[state >> line_bits], self._line_ids[state & line_mask]))
+            state = prev[state]
+        path.reverse()
+        return path
+
     def _build_route(self, path: list[tuple[str, str]]) -> Route:
         """Convert path to Route object with segments using real GTFS travel times."""
         if not path:
@@ -399,24 +601,26 @@ class SubwayGraph:
             return 0
         
         if self.gtfs_parser:
+            # A run of consecutive stations along the line is a difference
+            # of two cumulative totals
+            index = self._line_index.get(line)
+            if index is not None:
+                start = index.get(stations[0].id)
+                end = index.get(stations[-1].id)
+                if start is not None and end is not None and abs(end - start) == len(stations) - 1:
+                    step = 1 if end > start else -1
+                    if all(index.get(s.id) == start + k * step for k, s in enumerate(stations)):
+                        if step == 1:
+                            cum = self._cum_forward[line]
+                            return round((cum[end] - cum[start]) / 60)
+                        cum = self._cum_backward[line]
+                        return round((cum[start] - cum[end]) / 60)
+
             # Sum up travel times between consecutive stations using GTFS data
             total_seconds = 0
             for i in range(len(stations) - 1):
-                from_station = stations[i]
-                to_station = stations[i + 1]
-                
-                travel_seconds = self.gtfs_parser.get_travel_time(
-                    from_station.gtfs_stop_id,
-                    to_station.gtfs_stop_id,
-                    route_id=line
-                )
-                
-                if travel_seconds is not None:
-                    total_seconds += travel_seconds
-                else:
-                    # Fallback to estimate for this segment
-                    total_seconds += AVG_TIME_BETWEEN_STOPS * 60
-            
+                total_seconds += self._edge_seconds(stations[i], stations[i + 1], line)
+
             return round(total_seconds / 60)
         else:
             # Fallback to estimate
@@ -428,22 +632,16 @@ class SubwayGraph:
         """Travel time in minutes from A to B staying on one line. Returns None if no path on that line."""
         if from_station_id == to_station_id:
             return 0
-        if from_station_id not in self.adjacency or to_station_id not in self.adjacency:
+        table = self._line_minutes.get(line)
+        if table is None:
             return None
-        # BFS from from_station_id following only edges with this line
-        q = deque([(from_station_id, 0)])
-        seen = {from_station_id}
-        while q:
-            current, total_time = q.popleft()
-            for neighbor, edge_line, edge_time in self.adjacency.get(current, []):
-                if edge_line != line:
-                    continue
-                if neighbor == to_station_id:
-                    return total_time + edge_time
-                if neighbor not in seen:
-                    seen.add(neighbor)
-                    q.append((neighbor, total_time + edge_time))
-        return None
+        start = table.get(from_station_id)
+        end = table.get(to_station_id)
+        if start is None or end is None or start[0] != end[0]:
+            return None
+        if end[1] > start[1]:
+            return end[2] - start[2]
+        return start[3] - end[3]
 
     def find_routes(
         self, from_station_id: str, to_station_id: str, max_results: int = 3
@@ -460,8 +658,27 @@ class SubwayGraph:
         return routes
 
 
-# Singleton instance
-subway_graph = SubwayGraph()
+# Singleton instance, built on first use so importing this module doesn't
+# load (or download) the GTFS data
+_subway_graph: Optional[SubwayGraph] = None
+_subway_graph_lock = threading.Lock()
+
+
+def get_subway_graph() -> SubwayGraph:
+    """Get or create the subway graph singleton."""
+    global _subway_graph
+    if _subway_graph is None:
+        with _subway_graph_lock:
+            if _subway_graph is None:
+                _subway_graph = SubwayGraph()
+    return _subway_graph
+
+
+def __getattr__(name: str):
+    # Keeps `routing.subway_graph` working without building it at import
+    if name == "subway_graph":
+        return get_subway_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def find_route(from_name: str, to_name: str) -> Optional[Route]:
@@ -474,9 +691,14 @@ def find_route(from_name: str, to_name: str) -> Optional[Route]:
     if not to_station:
         return None
 
-    return subway_graph.find_route(from_station.id, to_station.id)
+    return get_subway_graph().find_route(from_station.id, to_station.id)
+
+
+def warm_route_cache(pairs: list[tuple[str, str]]):
+    """Precompute routes for popular (from_id, to_id) station pairs."""
+    get_subway_graph().warm_route_cache(pairs)
 
 
 def get_travel_time_on_line(from_station_id: str, to_station_id: str, line: str) -> Optional[int]:
     """Travel time in minutes from A to B on one line. None if no path on that line."""
-    return subway_graph.get_travel_time_on_line(from_station_id, to_station_id, line)
+    return get_subway_graph().get_travel_time_on_line(from_station_id, to_station_id, line)
@@ -2,11 +2,12 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Station:
     """Represents a subway station."""
     id: str
@@ -16,6 +17,16 @@ class Station:
     latitude: float
     longitude: float
     borough: str
+    name_lower: str = field(init=False, repr=False, compare=False)
+    # Bitwise OR of LINE_BITS for the station's lines
+    lines_mask: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "name_lower", self.name.lower())
+        mask = 0
+        for line in self.lines:
+            mask |= LINE_BITS.get(line, 0)
+        object.__setattr__(self, "lines_mask", mask)
 
     def __hash__(self):
         return hash(self.id)
@@ -293,6 +304,12 @@ STATIONS_DATA = [
     ("3rd_av_138", "3rd Av-138th St", ["6"], "618", 40.8101, -73.9262, "Bronx"),
 ]
 
+# One bit per line served by any station, in sorted line order
+LINE_BITS: dict[str, int] = {
+    line: 1 << i
+    for i, line in enumerate(sorted({line for data in STATIONS_DATA for line in data[2]}))
+}
+
 # Build station objects
 STATIONS = {}
 for data in STATIONS_DATA:
@@ -310,7 +327,7 @@ for data in STATIONS_DATA:
 # Build lookup by name (case-insensitive, partial match)
 STATION_NAME_INDEX: dict[str, Station] = {}
 for station in STATIONS.values():
-    name_lower = station.name.lower()
+    name_lower = station.name_lower
     STATION_NAME_INDEX[name_lower] = station
     # Also index without "St", "Av", etc.
     for word in ["st", "av", "ave", "blvd", "rd", "pkwy"]:
@@ -318,6 +335,20 @@ for station in STATIONS.values():
         if simplified != name_lower:
             STATION_NAME_INDEX[simplified] = station
 
+# Indexed names shortest first (ties in index order), so the partial match
+# in find_station can stop at the first hit
+_NAMES_BY_LENGTH: list[tuple[str, Station]] = sorted(
+    STATION_NAME_INDEX.items(), key=lambda item: len(item[0])
+)
+
+# Stations by lowercase borough and by line, in STATIONS order
+STATIONS_BY_BOROUGH: dict[str, list[Station]] = {}
+STATIONS_BY_LINE: dict[str, list[Station]] = {}
+for station in STATIONS.values():
+    STATIONS_BY_BOROUGH.setdefault(station.borough.lower(), []).append(station)
+    for line in station.lines:
+        STATIONS_BY_LINE.setdefault(line, []).append(station)
+
 # Common aliases for popular stations
 STATION_ALIASES: dict[str, str] = {
     "times square": "42nd_times_sq",
@@ -394,8 +425,13 @@ STATION_ALIASES: dict[str, str] = {
 }
 
 
+@lru_cache(maxsize=2048)
 def find_station(query: str) -> Optional[Station]:
-    """Find a station by name (fuzzy match)."""
+    """Find a station by name (fuzzy match).
+
+    Results are memoized per query string; stations never change after
+    import, so cached results don't go stale.
+    """
     query_lower = query.lower().strip()
 
     # Check aliases first
@@ -407,14 +443,9 @@ def find_station(query: str) -> Optional[Station]:
         return STATION_NAME_INDEX[query_lower]
 
     # Partial match - prefer shorter station names (more specific)
-    matches = []
-    for name, station in STATION_NAME_INDEX.items():
+    for name, station in _NAMES_BY_LENGTH:
         if query_lower in name or name in query_lower:
-            matches.append((len(name), station))
-
-    if matches:
-        matches.sort(key=lambda x: x[0])
-        return matches[0][1]
+            return station
 
     # Check station IDs
     for station_id, station in STATIONS.items():
@@ -424,10 +455,10 @@ def find_station(query: str) -> Optional[Station]:
     return None
 
 
-def find_stations_by_line(line: str) -> list[Station]:
+@lru_cache(maxsize=64)
+def find_stations_by_line(line: str) -> tuple[Station, ...]:
     """Find all stations on a given line."""
-    line = line.upper()
-    return [s for s in STATIONS.values() if line in s.lines]
+    return tuple(STATIONS_BY_LINE.get(line.upper(), ()))
 
 
 def get_station_lines(station_id: str) -> list[str]:
@@ -5,7 +5,7 @@ from langchain_core.tools import tool
 
 from .stations import find_station, find_stations_by_line, STATIONS
 from .mta_feed import get_arrivals
-from .routing import find_route, subway_graph, get_travel_time_on_line
+from .routing import find_route, get_subway_graph, get_travel_time_on_line
 from .database import db
 from .gtfs_static import get_gtfs_parser
 
@@ -39,7 +39,7 @@ def get_route(from_station: str, to_station: str) -> str:
     if not to_st:
         return f"Could not find station: {to_station}. Try being more specific."
 
-    route = subway_graph.find_route(from_st.id, to_st.id)
+    route = get_subway_graph().find_route(from_st.id, to_st.id)
 
     if not route:
         return f"Could not find a route from {from_st.name} to {to_st.name}."
@@ -83,7 +83,7 @@ def get_route_with_arrivals(from_station: str, to_station: str) -> str:
     if not to_st:
         return f"Could not find station: {to_station}. Try being more specific."
 
-    route = subway_graph.find_route(from_st.id, to_st.id)
+    route = get_subway_graph().find_route(from_st.id, to_st.id)
     if not route:
         return f"Could not find a route from {from_st.name} to {to_st.name}."
 
@@ -393,7 +393,7 @@ def get_transfer_timing(from_station: str, to_station: str) -> str:
     if not from_st or not to_st:
         return f"Could not find station(s). Check: from={from_station}, to={to_station}."
 
-    route = subway_graph.find_route(from_st.id, to_st.id)
+    route = get_subway_graph().find_route(from_st.id, to_st.id)
     if not route:
         return f"Could not find a route from {from_st.name} to {to_st.name}."
 
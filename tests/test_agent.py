@@ -0,0 +1,113 @@
+"""Tests for agent helpers that don't need the LLM."""
+
+import inspect
+from collections import OrderedDict
+
+import pytest
+from subway_agent.agent import (
+    HISTORY_LIMIT, _classify_intent, _context_limit, _dedupe_tool_calls, _held_suffix_len,
+    parse_legacy_tool_call,
+)
+
+
+@pytest.mark.parametrize("text", [
+    '<function=get_train_arrivals{"station_name": "South Ferry"}></function>',
+    '<function=get_train_arrivals {"station_name": "South Ferry"}></function>',
+    '<function=get_train_arrivals{"station_name": "South Ferry"}</function>',
+    '<function=get_train_arrivals>{"station_name": "South Ferry"}</function>',
+    '<function=get_train_arrivals>"station_name": "South Ferry"</function>',
+])
+def test_parse_legacy_tool_call_formats(text):
+    """Test each supported legacy tool call format."""
+    assert parse_legacy_tool_call(text) == ("get_train_arrivals", {"station_name": "South Ferry"})
+
+
+def test_parse_legacy_tool_call_escaped_quotes():
+    """Test parsing a tool call embedded in an error message."""
+    text = '<function=get_station_info{\\"station_name\\": \\"Penn\\"}></function>'
+    assert parse_legacy_tool_call(text) == ("get_station_info", {"station_name": "Penn"})
+
+
+def test_parse_legacy_tool_call_braces_in_arguments():
+    """Test the argument object is delimited by its matching brace."""
+    text = '<function=plan_trip_with_transfers{}></function>'
+    assert parse_legacy_tool_call(text) == ("plan_trip_with_transfers", {})
+    text = '<function=get_station_info{"station_name": "a}b"}</function>'
+    assert parse_legacy_tool_call(text) == ("get_station_info", {"station_name": "a}b"})
+
+
+def test_parse_legacy_tool_call_no_match():
+    """Test plain text is not treated as a tool call."""
+    assert parse_legacy_tool_call("The next 1 train is in 3 min.") is None
+
+
+def test_classify_intent_next_train():
+    """Test simple arrival questions skip the LLM."""
+    assert _classify_intent("When is the next 1 train at South Ferry?") == (
+        "get_train_arrivals", {"station_name": "South Ferry", "line": "1"}
+    )
+    assert _classify_intent("when's the next train at Times Square") == (
+        "get_train_arrivals", {"station_name": "Times Square"}
+    )
+
+
+def test_classify_intent_falls_through():
+    """Test open-ended or unresolvable questions go to the LLM."""
+    assert _classify_intent("Fastest way South Ferry to Penn now?") is None
+    assert _classify_intent("When is the next 1 train at Nowhere Land?") is None
+
+
+def test_context_limit_grows_with_message_length():
+    """Test short follow-ups get less history than long questions."""
+    assert _context_limit("is this real-time?") == 3
+    assert _context_limit("How do I get from Union Square to Lincoln Center right now?") == 5
+    assert _context_limit("x" * 200) == HISTORY_LIMIT
+
+
+def test_dedupe_tool_calls():
+    """Test identical calls in one turn share a single execution."""
+    calls = [
+        {"name": "get_train_arrivals", "args": {"station_name": "Penn", "line": "1"}, "id": "a"},
+        {"name": "get_station_info", "args": {"station_name": "Penn"}, "id": "b"},
+        {"name": "get_train_arrivals", "args": {"line": "1", "station_name": "Penn"}, "id": "c"},
+    ]
+    unique, index = _dedupe_tool_calls(calls)
+    assert [c["id"] for c in unique] == ["a", "b"]
+    assert index == [0, 1, 0]
+
+
+def test_held_suffix_len():
+    """Test streaming holds back only text that could start a legacy call."""
+    assert _held_suffix_len("Sure. <fun") == 4
+    assert _held_suffix_len("Sure. <") == 1
+    assert _held_suffix_len("Sure. <func in") == 0
+    assert _held_suffix_len("Sure.") == 0
+
+
+def test_execute_tool_runs_tool_once_on_inner_type_error(monkeypatch):
+    """Test a TypeError raised inside a tool isn't retried as bad args."""
+    from subway_agent import agent
+    calls = []
+
+    def broken(station_name: str):
+        calls.append(station_name)
+        raise TypeError("bug in tool")
+
+    monkeypatch.setitem(agent._TOOL_FUNCS, "find_stations_on_line", broken)
+    monkeypatch.setitem(agent._TOOL_SIGNATURES, "find_stations_on_line", inspect.signature(broken))
+    result = agent.execute_tool("find_stations_on_line", {"station_name": "x"})
+    assert result == "Error executing find_stations_on_line: bug in tool"
+    assert calls == ["x"]
+
+
+def test_history_cache_evicts_least_recent_user(monkeypatch):
+    """Test the per-user history cache stays within its size cap."""
+    from subway_agent import agent
+    monkeypatch.setattr(agent, "_history_cache", OrderedDict())
+    monkeypatch.setattr(agent, "_HISTORY_CACHE_SIZE", 2)
+    monkeypatch.setattr(agent.db, "get_recent_messages", lambda user_id, limit: [])
+    agent._get_history("a")
+    agent._get_history("b")
+    agent._get_history("a")
+    agent._get_history("c")
+    assert list(agent._history_cache) == ["a", "c"]
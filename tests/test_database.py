@@ -1,6 +1,7 @@
 """Tests for database functionality."""
 
 import pytest
+import sqlite3
 import tempfile
 from pathlib import Path
 from subway_agent.database import Database
@@ -13,6 +14,7 @@ def test_db():
         db_path = Path(tmpdir) / "test.db"
         db = Database(db_path)
         yield db
+        db.close()
 
 
 def test_set_and_get_preference(test_db):
@@ -36,6 +38,22 @@ def test_update_preference(test_db):
     assert value == "new_value"
 
 
+def test_all_preferences_cache_invalidated_on_write(test_db):
+    """Test cached preferences reflect a later write."""
+    test_db.set_preference("home", "a")
+    assert test_db.get_all_preferences() == {"home": "a"}
+    test_db.set_preference("work", "b")
+    assert test_db.get_all_preferences() == {"home": "a", "work": "b"}
+
+
+def test_preferences_cache_evicts_least_recent_user(test_db, monkeypatch):
+    """Test the preferences cache stays within its size cap."""
+    monkeypatch.setattr("subway_agent.database.PREFERENCES_CACHE_SIZE", 2)
+    for user_id in ("a", "b", "a", "c"):
+        test_db.get_all_preferences(user_id)
+    assert list(test_db._prefs_cache) == ["a", "c"]
+
+
 def test_add_trip(test_db):
     """Test adding trip history."""
     test_db.add_trip("times_square", "grand_central")
@@ -61,3 +79,41 @@ def test_clear_conversation(test_db):
     test_db.clear_conversation()
     messages = test_db.get_recent_messages()
     assert len(messages) == 0
+
+
+def test_close_saves_queued_messages_and_stops_flusher():
+    """Test close() writes pending messages and ends the background thread."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = Path(tmpdir) / "test.db"
+        db = Database(db_path)
+        db.add_message("user", "Hello")
+        db.close()
+        assert not db._flush_thread.is_alive()
+        db.close()  # second call is a no-op
+
+        reopened = Database(db_path)
+        assert reopened.get_recent_messages() == [{"role": "user", "content": "Hello"}]
+        reopened.close()
+
+
+def test_failed_flush_keeps_messages(test_db):
+    """Test messages stay queued when a write fails."""
+
+    class FailingConnection:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, *args):
+            return self.conn.execute(*args)
+
+        def executemany(self, *args):
+            raise sqlite3.OperationalError("disk I/O error")
+
+    conn = test_db.conn
+    # Queued without notifying the background flusher, so only this flush runs
+    test_db._pending.append(("default", "user", "Hello"))
+    test_db.conn = FailingConnection(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        test_db.flush()
+    test_db.conn = conn
+    assert test_db.get_recent_messages() == [{"role": "user", "content": "Hello"}]
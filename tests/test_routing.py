@@ -44,3 +44,18 @@ def test_invalid_station_route():
     """Test route with invalid station returns None."""
     route = find_route("nonexistent station", "times square")
     assert route is None
+
+
+def test_subway_graph_is_shared_singleton():
+    """Test the lazily built graph is the one behind routing.subway_graph."""
+    from subway_agent import routing
+    assert routing.get_subway_graph() is routing.get_subway_graph()
+    assert routing.subway_graph is routing.get_subway_graph()
+
+
+def test_repeat_route_query_is_cached():
+    """Test a repeated query is answered from the route cache."""
+    from_station = find_station("south ferry")
+    to_station = find_station("grand central")
+    first = subway_graph.find_route(from_station.id, to_station.id)
+    assert subway_graph.find_route(from_station.id, to_station.id) is first